@@ -1,17 +1,126 @@
+from concurrent.futures import ThreadPoolExecutor
 from sklearn.cluster import DBSCAN
+from scipy import sparse
 import numpy as np
 import cv2
 
+from analysis_context import AnalysisContext
+
+
+FLANN_INDEX_KDTREE = 1
+
+
+def strongestPerTile(key_points, shape, tiles, nfeatures):
+    # Indices of the strongest keypoints of each cell of a (rows, cols) grid
+    # over an image of the given shape, so that the budget of nfeatures (0
+    # for no limit) is spread evenly over the image.
+    rows, cols = tiles
+    h, w = shape[:2]
+    if not nfeatures or not len(key_points):
+        return np.arange(len(key_points))
+    points = np.array([kp.pt for kp in key_points])
+    response = np.array([kp.response for kp in key_points])
+    row = np.minimum((points[:, 1] * rows / h).astype(int), rows-1)
+    col = np.minimum((points[:, 0] * cols / w).astype(int), cols-1)
+    tile = row * cols + col
+
+    # strongest first within each tile, then rank inside the tile
+    order = np.lexsort((-response, tile))
+    tile = tile[order]
+    rank = np.arange(len(tile)) - np.searchsorted(tile, tile)
+    budget = -(-nfeatures // (rows * cols))
+    return np.sort(order[rank < budget])
+
+
+def tileSift(gray, box, overlap):
+    # SIFT over one (x0, y0, x1, y1) tile widened by overlap on every side.
+    # Only keypoints whose position falls inside the tile itself are kept,
+    # so every keypoint of the overlap zones belongs to exactly one tile.
+    x0, y0, x1, y1 = box
+    h, w = gray.shape
+    px0, py0 = max(x0-overlap, 0), max(y0-overlap, 0)
+    px1, py1 = min(x1+overlap, w), min(y1+overlap, h)
+    sift = cv2.SIFT_create()
+    key_points, descriptors = sift.detectAndCompute(gray[py0:py1, px0:px1], None)
+    if descriptors is None:
+        return [], np.zeros((0, 128), dtype=np.float32)
+    keep = [i for i, kp in enumerate(key_points)
+            if x0 <= kp.pt[0]+px0 < x1 and y0 <= kp.pt[1]+py0 < y1]
+    shifted = [cv2.KeyPoint(kp.pt[0]+px0, kp.pt[1]+py0, kp.size, kp.angle,
+                            kp.response, kp.octave, kp.class_id)
+               for kp in (key_points[i] for i in keep)]
+    return shifted, descriptors[keep]
+
+
+def parallelSift(gray, workers, tileSize=1024, overlap=64):
+    # SIFT of the whole image computed tile by tile in a thread pool;
+    # OpenCV releases the GIL while it works on a tile.
+    h, w = gray.shape
+    boxes = [(x, y, min(x+tileSize, w), min(y+tileSize, h))
+             for y in range(0, h, tileSize) for x in range(0, w, tileSize)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda box: tileSift(gray, box, overlap), boxes))
+    key_points = [kp for kps, _ in results for kp in kps]
+    descriptors = np.vstack([desc for _, desc in results])
+    return key_points, descriptors
+
 
 class Detect(object):
     def __init__(self, input):
-        self.image = cv2.imread(input)
+        context = AnalysisContext.of(input)
+        self.path = context.path
+        self.image = context.bgr
+
+    def siftDetector(self, nfeatures=0, tiles=None, compact=False, workers=0,
+                     tileSize=1024, overlap=64, cache=None):
+        """
+        Function to detect SIFT keypoints and descriptors
+        :param nfeatures: Keypoint budget, 0 keeps every keypoint
+        :param tiles: Optional (rows, cols) grid; the budget is split evenly
+            over its cells and each cell keeps its strongest keypoints
+        :param compact: Store the descriptors as uint8 instead of float32;
+            SIFT values are whole numbers in 0-255, so nothing is lost
+        :param workers: Number of threads for tiled extraction, 0 runs a
+            single SIFT pass over the whole image
+        :param tileSize: Side of the extraction tiles when workers is set
+        :param overlap: Context added around each extraction tile so that
+            keypoints near tile borders are found and described as usual
+        :param cache: Optional FeatureCache; features already extracted from
+            the same file with the same parameters are loaded from it
+        :return: The keypoints and their descriptors
+        """
+        if cache is not None:
+            # tileSize and overlap only affect threaded extraction
+            params = dict(nfeatures=nfeatures, tiles=tiles, compact=compact,
+                          tileSize=tileSize if workers else None,
+                          overlap=overlap if workers else None)
+            key = cache.key(self.path, params)
+            cached = cache.load(key)
+            if cached is not None:
+                self.key_points, self.descriptors = cached
+                return self.key_points, self.descriptors
+            self.siftDetector(nfeatures, tiles, compact, workers, tileSize, overlap)
+            cache.store(key, self.key_points, self.descriptors)
+            return self.key_points, self.descriptors
 
-    def siftDetector(self):
-        sift = cv2.SIFT_create()
         # sift = cv2.xfeatures2d.SIFT_create()
         gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
-        self.key_points, self.descriptors = sift.detectAndCompute(gray, None)
+        if workers:
+            key_points, descriptors = parallelSift(gray, workers, tileSize, overlap)
+            keep = strongestPerTile(key_points, gray.shape, tiles or (1, 1), nfeatures)
+            self.key_points = [key_points[i] for i in keep]
+            self.descriptors = descriptors[keep]
+        elif tiles is None:
+            sift = cv2.SIFT_create(nfeatures=nfeatures)
+            self.key_points, self.descriptors = sift.detectAndCompute(gray, None)
+        else:
+            # Detect everything once, then describe only the kept keypoints.
+            sift = cv2.SIFT_create()
+            key_points = sift.detect(gray, None)
+            keep = strongestPerTile(key_points, gray.shape, tiles, nfeatures)
+            self.key_points, self.descriptors = sift.compute(gray, [key_points[i] for i in keep])
+        if compact and self.descriptors is not None:
+            self.descriptors = np.clip(np.rint(self.descriptors), 0, 255).astype(np.uint8)
         return self.key_points, self.descriptors
 
     def showSiftFeatures(self):
@@ -20,25 +129,141 @@ class Detect(object):
             self.image, self.key_points, self.image.copy())
         return sift_image
 
-    def locateForgery(self, eps=40, min_sample=2):
-        clusters = DBSCAN(eps=eps, min_samples=min_sample).fit(
-            self.descriptors)
-        size = np.unique(clusters.labels_).shape[0]-1
-        forgery = self.image.copy()
-        if (size == 0) and (np.unique(clusters.labels_)[0] == -1):
+    def matchPairs(self, eps=40, knn=10, ratio=0.6, checks=32, trees=4, seed=0):
+        """
+        Function to find candidate pairs of similar descriptors with an
+        approximate nearest neighbour search and the g2NN test
+        :param eps: Largest descriptor distance kept for a pair
+        :param knn: Number of neighbours searched per descriptor; fewer is
+            faster but can miss copies of features repeated many times
+        :param ratio: g2NN ratio; neighbours are kept while the distance to
+            each one is below ratio times the distance to the next
+        :param checks: Number of leaves the KD-forest visits per query;
+            fewer is faster but less exact
+        :param trees: Number of randomised KD-trees in the forest
+        :param seed: Seed for OpenCV's random generator, which builds the
+            randomised trees, so that repeated runs agree
+        :return: A tuple (rows, cols, distances) with each unordered pair
+            of descriptor indices listed once
+        """
+        descriptors = np.ascontiguousarray(self.descriptors, dtype=np.float32)
+        count = len(descriptors)
+        knn = min(knn + 1, count)
+        cv2.setRNGSeed(seed)
+        index = cv2.flann_Index(descriptors, dict(algorithm=FLANN_INDEX_KDTREE, trees=trees))
+        neighbours, distances = index.knnSearch(descriptors, knn, params=dict(checks=checks))
+        # FLANN reports squared L2 distances; the first hit is the point itself
+        neighbours = neighbours[:, 1:].astype(np.int64)
+        distances = np.sqrt(distances[:, 1:])
+
+        # g2NN: accept the neighbours up to the first ratio test failure
+        passed = distances[:, :-1] <= ratio * distances[:, 1:]
+        accepted = np.zeros(distances.shape, dtype=bool)
+        accepted[:, :-1] = np.cumprod(passed, axis=1).astype(bool)
+
+        rows = np.repeat(np.arange(count), neighbours.shape[1]).reshape(neighbours.shape)
+        keep = accepted & (distances <= eps) & (neighbours >= 0) & (neighbours != rows)
+        first = np.minimum(rows[keep], neighbours[keep])
+        second = np.maximum(rows[keep], neighbours[keep])
+        pairs, unique = np.unique(np.column_stack((first, second)), axis=0, return_index=True)
+        return pairs[:, 0], pairs[:, 1], distances[keep][unique]
+
+    def clusterLabels(self, eps, min_sample, engine='flann', **match):
+        if self.descriptors is None or len(self.descriptors) < 2:
+            return -np.ones(len(self.key_points), dtype=int)
+        if engine == 'dbscan':
+            return DBSCAN(eps=eps, min_samples=min_sample).fit(self.descriptors).labels_
+        if engine != 'flann':
+            raise ValueError('Unknown matching engine: {}'.format(engine))
+        # DBSCAN only sees the candidate pairs, as a sparse distance graph.
+        # Zero distances stay explicit entries and still count as neighbours.
+        count = len(self.descriptors)
+        rows, cols, distances = self.matchPairs(eps, **match)
+        graph = sparse.csr_matrix(
+            (np.concatenate((distances, distances)),
+             (np.concatenate((rows, cols)), np.concatenate((cols, rows)))),
+            shape=(count, count))
+        return DBSCAN(eps=eps, min_samples=min_sample, metric='precomputed').fit(graph).labels_
+
+    def clusterPairs(self, labels):
+        # (first, other) keypoint indices that link the first keypoint of
+        # every cluster to each of its other keypoints.
+        members = np.flatnonzero(labels != -1)
+        members = members[np.argsort(labels[members], kind='stable')]
+        grouped = labels[members]
+        starts = np.searchsorted(grouped, grouped)
+        other = starts != np.arange(len(members))
+        return members[starts[other]], members[other]
+
+    def verifyRegions(self, first, other, minInliers=4, threshold=3.0,
+                      minDistance=10, maxRegions=16):
+        """
+        Function to keep only the matched keypoints explained by a common
+        geometric transform, found with RANSAC one region at a time
+        :param first: Indices of the first keypoint of each matched pair
+        :param other: Indices of the second keypoint of each matched pair
+        :param minInliers: Fewest pairs a transform must explain
+        :param threshold: RANSAC reprojection threshold in pixels
+        :param minDistance: Pairs closer than this in the image are ignored
+        :param maxRegions: Largest number of regions searched for
+        :return: A list of regions, each a dict with the 'source' and
+            'target' bounding boxes (x0, y0, x1, y1), the 2x3 similarity
+            'transform' from source to target, the 'inliers' count and the
+            inlier 'pairs' as an (n, 2) array of keypoint indices
+        """
+        points = np.array([kp.pt for kp in self.key_points], dtype=np.float32).reshape(-1, 2)
+        near = np.hypot(*(points[first] - points[other]).T) < minDistance
+        first, other = first[~near], other[~near]
+
+        # A pair can point either way, so both orientations are offered to
+        # RANSAC and a pair is used up once either one is an inlier.
+        ids = np.concatenate((np.arange(len(first)), np.arange(len(first))))
+        src = np.concatenate((first, other))
+        dst = np.concatenate((other, first))
+        regions = []
+        while len(np.unique(ids)) >= minInliers and len(regions) < maxRegions:
+            transform, mask = cv2.estimateAffinePartial2D(
+                points[src], points[dst], method=cv2.RANSAC,
+                ransacReprojThreshold=threshold)
+            if transform is None:
+                break
+            mask = mask.ravel().astype(bool)
+            used = np.unique(ids[mask])
+            if len(used) < minInliers:
+                break
+            regions.append({
+                'source': tuple(int(v) for v in np.r_[points[src[mask]].min(axis=0), points[src[mask]].max(axis=0)]),
+                'target': tuple(int(v) for v in np.r_[points[dst[mask]].min(axis=0), points[dst[mask]].max(axis=0)]),
+                'transform': transform,
+                'inliers': len(used),
+                'pairs': np.column_stack((src[mask], dst[mask])),
+            })
+            left = ~np.isin(ids, used)
+            ids, src, dst = ids[left], src[left], dst[left]
+        return regions
+
+    def locateForgery(self, eps=40, min_sample=2, engine='flann', verify=False,
+                      minInliers=4, **match):
+        labels = self.clusterLabels(eps, min_sample, engine, **match)
+        first, other = self.clusterPairs(labels)
+        # regions are only reported when verified
+        self.regions = []
+        if verify:
+            # keep only pairs explained by a RANSAC-verified transform
+            self.regions = self.verifyRegions(first, other, minInliers)
+            pairs = [region['pairs'] for region in self.regions]
+            first, other = np.concatenate(pairs + [np.zeros((0, 2), dtype=int)]).T
+        if not (labels != -1).any() or (verify and not self.regions):
             print('No Forgery Found!!')
             return None
-        if size == 0:
-            size = 1
-        cluster_list = [[] for i in range(size)]
-        for idx in range(len(self.key_points)):
-            if clusters.labels_[idx] != -1:
-                cluster_list[clusters.labels_[idx]].append(
-                    (int(self.key_points[idx].pt[0]), int(self.key_points[idx].pt[1])))
-        for points in cluster_list:
-            if len(points) > 1:
-                for idx1 in range(1, len(points)):
-                    # Green color in BGR
-                    cv2.line(forgery, points[0], points[idx1], (0, 255, 0), 5)
-                    # cv2.line(forgery, points[0], points[idx1], (255, 0, 0), 5)
+        forgery = self.image.copy()
+        points = np.array([kp.pt for kp in self.key_points]).astype(int).reshape(-1, 2)
+        lines = np.stack((points[first], points[other]), axis=1).astype(np.int32)
+        # Green color in BGR
+        cv2.polylines(forgery, list(lines), False, (0, 255, 0), 5)
+        # cv2.polylines(forgery, list(lines), False, (255, 0, 0), 5)
+        if verify:
+            for region in self.regions:
+                cv2.rectangle(forgery, region['source'][:2], region['source'][2:], (255, 0, 0), 3)
+                cv2.rectangle(forgery, region['target'][:2], region['target'][2:], (0, 0, 255), 3)
         return forgery
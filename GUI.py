@@ -1,13 +1,11 @@
 from importlib.resources import path
 from tkinter import *
 from tkinter import filedialog, ttk, messagebox
-from PIL import ImageTk, Image, ExifTags, ImageChops
+from PIL import ImageTk, Image, ExifTags
 from optparse import OptionParser
 from datetime import datetime
 from matplotlib import image
-from prettytable import PrettyTable
 import numpy as np
-import random
 import sys
 import cv2
 import re
@@ -16,15 +14,21 @@ import os
 from pyparsing import Opt
 
 from ForgeryDetection import Detect
+from feature_cache import FeatureCache
+from analysis_context import AnalysisContext
 import double_jpeg_compression
 import noise_variance
 import copy_move_cfa
+import error_level_analysis
+import steganography
+import hex_view
 
 
 # Global variables
 IMG_WIDTH = 400
 IMG_HEIGHT = 400
 uploaded_image = None
+uploaded_context = None
 
 # copy-move parameters
 cmd = OptionParser("usage: %prog image_file [options]")
@@ -76,9 +80,11 @@ def browseFile():
     if filename == "":
         return
 
-    global uploaded_image
+    global uploaded_image, uploaded_context
 
     uploaded_image = filename
+    # every detector shares one decode of the image
+    uploaded_context = AnalysisContext(filename)
 
     progressBar['value'] = 0   # Reset the progress bar
     fileLabel.configure(text=filename)     # Set the path name in the fileLabel
@@ -109,9 +115,10 @@ def copy_move_forgery():
         messagebox.showerror('Error', "Please select image")
         return
 
-    detect = Detect(path)
-    key_points, descriptors = detect.siftDetector()
+    detect = Detect(uploaded_context)
+    key_points, descriptors = detect.siftDetector(cache=FeatureCache())
     forgery = detect.locateForgery(eps, min_samples)
+    uploaded_context.release()
 
     # Set the progress bar to 100%
     progressBar['value'] = 100
@@ -159,8 +166,7 @@ def metadata_analysis():
         messagebox.showerror('Error', "Please select image")
         return
 
-    img = Image.open(path)
-    img_exif = img.getexif()
+    img_exif = uploaded_context.exif
 
     # Set the progress bar to 100%
     progressBar['value'] = 100
@@ -202,10 +208,14 @@ def noise_variance_inconsistency():
         messagebox.showerror('Error', "Please select image")
         return
 
-    noise_forgery = noise_variance.detect(path)
+    sigma, noise_forgery = noise_variance.detect_map(uploaded_context)
+    size = uploaded_context.header.size
+    uploaded_context.release()
 
     # Set the progress bar to 100%
     progressBar['value'] = 100
+    # Show where the noise differs: every block coloured by its sigma
+    Image.fromarray(noise_variance.heatmap(sigma, size=size)).show()
 
     if(noise_forgery):
         # print('\nNoise variance inconsistency detected')
@@ -235,7 +245,8 @@ def cfa_artifact():
         messagebox.showerror('Error', "Please select image")
         return
 
-    identical_regions_cfa = copy_move_cfa.detect(path, opt, args)
+    identical_regions_cfa = copy_move_cfa.detect(uploaded_context, opt, args)
+    uploaded_context.release()
     # identical_regions_cfa = copy_move_cfa.detect(path, opt, args)
 
 
@@ -267,7 +278,7 @@ def cfa_artifact():
 def ela_analysis():
     # Retrieve the path of the image file
     path = uploaded_image
-    TEMP = 'temp.jpg'
+    QUALITY = 90
     SCALE = 10
 
     # User has not selected an input image
@@ -276,20 +287,12 @@ def ela_analysis():
         messagebox.showerror('Error', "Please select image")
         return
 
-    original = Image.open(path)
-    original.save(TEMP, quality=90)
-    temporary = Image.open(TEMP)
-
-    diff = ImageChops.difference(original, temporary)
-    d = diff.load()
-    WIDTH, HEIGHT = diff.size
-    for x in range(WIDTH):
-        for y in range(HEIGHT):
-            d[x, y] = tuple(k * SCALE for k in d[x, y])
+    diff = error_level_analysis.ela(uploaded_context, quality=QUALITY, scale=SCALE)
+    uploaded_context.release()
 
     # Set the progress bar to 100%
     progressBar['value'] = 100
-    diff.show()
+    Image.fromarray(diff).show()
 
 
 
@@ -303,7 +306,8 @@ def jpeg_Compression():
         messagebox.showerror('Error', "Please select image")
         return
 
-    double_compressed = double_jpeg_compression.detect(path)
+    double_compressed = double_jpeg_compression.detect(uploaded_context)
+    uploaded_context.release()
 
     # Set the progress bar to 100%
     progressBar['value'] = 100
@@ -337,37 +341,14 @@ def image_decode():
         messagebox.showerror('Error', "Please select image")
         return
     
-    # Encrypted image
-    img = cv2.imread(path) 
-    width = img.shape[0]
-    height = img.shape[1]
-      
-    # img1 and img2 are two blank images
-    img1 = np.zeros((width, height, 3), np.uint8)
-    img2 = np.zeros((width, height, 3), np.uint8)
-      
-    for i in range(width):
-        for j in range(height):
-            for l in range(3):
-                v1 = format(img[i][j][l], '08b')
-                v2 = v1[:4] + chr(random.randint(0, 1)+48) * 4
-                v3 = v1[4:] + chr(random.randint(0, 1)+48) * 4
-                  
-                # Appending data to img1 and img2
-                img1[i][j][l]= int(v2, 2)
-                img2[i][j][l]= int(v3, 2)
-    
+    # The image hidden in the 4 least significant bits
+    hidden = steganography.extract(uploaded_context, planes=(0, 1, 2, 3))
+    uploaded_context.release()
+
     # Set the progress bar to 100%
     progressBar['value'] = 100
 
-    # These are two images produced from
-    # the encrypted image
-    # cv2.imwrite('pic2_re.png', img1)
-    cv2.imwrite('output.png', img2)
-    # Image.show(img2)
-    # creating a object
-    im = Image.open('output.png')
-    im.show()
+    Image.fromarray(hidden).show()
 
 def string_analysis():
     # Retrieve the path of the image file
@@ -378,35 +359,19 @@ def string_analysis():
         messagebox.showerror('Error', "Please select image")
         return
     
-    x=PrettyTable()
-    x.field_names = ["Bytes", "8-bit", "string"]
-    # x.border = False
-    with open(path, "rb") as f:
-            n = 0
-            b = f.read(16)
-
-            while b:
-                s1 = " ".join([f"{i:02x}" for i in b])  # hex string
-                # insert extra space between groups of 8 hex values
-                s1 = s1[0:23] + " " + s1[23:]
-
-                # ascii string; chained comparison
-                s2 = "".join([chr(i) if 32 <= i <= 127 else "." for i in b])
-
-                # print(f"{n * 16:08x}  {s1:<48}  |{s2}|")
-                x.add_row([f"{n * 16:08x}",f"{s1:<48}",f"{s2}"])
-
-                n += 1
-                b = f.read(16)
-            
-            # Set the progress bar to 100%
-            progressBar['value'] = 100
-
-            with open('hex_viewer.txt', 'w') as w:
-                w.write(str(x))
-                # w.write(f"{os.path.getsize(path):08x}")
-            os.startfile('hex_viewer.txt')
-            # print(f"{os.path.getsize(filename):08x}")
+    # Only the visible rows of the dump are formatted, as the view scrolls
+    view = hex_view.HexView(path)
+    window = Toplevel(root)
+    window.title(os.path.basename(path))
+    hex_view.HexViewer(window, view).pack(fill=BOTH, expand=True)
+
+    def close():
+        view.close()
+        window.destroy()
+    window.protocol("WM_DELETE_WINDOW", close)
+
+    # Set the progress bar to 100%
+    progressBar['value'] = 100
 
 # Initialize the app window
 root = Tk()
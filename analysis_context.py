@@ -0,0 +1,93 @@
+from PIL import Image
+import numpy as np
+import cv2
+
+
+class AnalysisContext(object):
+    """
+    One image shared by every detector. The pixels are decoded once, on
+    first use, and the RGB, gray and palette views are derived from that
+    decode when first asked for and kept until released.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.views = {}
+
+    @classmethod
+    def of(cls, input):
+        # Detectors accept either a path or a context.
+        return input if isinstance(input, cls) else cls(input)
+
+    def view(self, key, build):
+        if key not in self.views:
+            self.views[key] = build()
+        return self.views[key]
+
+    def release(self, *keys):
+        # Drops the given views, by default every array derived from the
+        # decode; they are rebuilt if asked for again. Detectors run one
+        # after another, so freeing their views in between keeps only the
+        # shared decode alive.
+        if not keys:
+            keys = [key for key in self.views if key not in ('header', 'exif', 'bgr')]
+        for key in keys:
+            self.views.pop(key, None)
+
+    @property
+    def header(self):
+        # PIL only reads the header here; pixels come from the cv2 decode.
+        return self.view('header', lambda: Image.open(self.path))
+
+    @property
+    def exif(self):
+        return self.view('exif', lambda: self.header.getexif())
+
+    @property
+    def bgr(self):
+        def decode():
+            # EXIF orientation is ignored, as PIL ignores it, so the views
+            # match the path-based detectors pixel for pixel
+            image = cv2.imread(self.path, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+            if image is None:
+                raise ValueError('Cannot decode image: {}'.format(self.path))
+            return image
+        return self.view('bgr', decode)
+
+    @property
+    def rgb(self):
+        return self.view('rgb', lambda: cv2.cvtColor(self.bgr, cv2.COLOR_BGR2RGB))
+
+    @property
+    def gray(self):
+        return self.view('gray', lambda: cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY))
+
+    # ycrcb and binary each serve a single detector, so they are built on
+    # every access instead of being kept.
+
+    @property
+    def ycrcb(self):
+        return cv2.cvtColor(self.bgr, cv2.COLOR_BGR2YCR_CB)
+
+    @property
+    def binary(self):
+        # Floyd-Steinberg dithered bilevel image, as PIL's convert('1'),
+        # which dithers colour and gray sources differently.
+        if self.header.mode in ('1', 'L'):
+            source = self.gray
+        else:
+            # dithered from RGB without keeping the RGB view
+            source = self.views.get('rgb')
+            if source is None:
+                source = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2RGB)
+        return np.asarray(Image.fromarray(source).convert('1'))
+
+    def image(self):
+        # A fresh PIL copy of the pixels for detectors that draw on it.
+        return Image.fromarray(self.rgb)
+
+    def palette(self, imblev, impalred):
+        # Blurred, palette-reduced gray view used by copy-move block matching.
+        import copy_move_cfa
+        return self.view(('palette', int(imblev), int(impalred)),
+                         lambda: copy_move_cfa.palettearray(self.gray, imblev, impalred))
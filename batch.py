@@ -0,0 +1,226 @@
+import contextlib
+import glob
+import json
+import os
+import sys
+import time
+from optparse import OptionParser
+
+from PIL import Image, ExifTags
+import numpy as np
+import cv2
+
+from ForgeryDetection import Detect
+from feature_cache import FeatureCache
+from analysis_context import AnalysisContext
+from scheduler import schedule, runTask
+import double_jpeg_compression
+import noise_variance
+import copy_move_cfa
+import error_level_analysis
+
+
+DETECTORS = ('double_compression', 'metadata', 'noise_variance', 'cfa', 'copy_move', 'ela')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+# copy-move parameters
+cmd = OptionParser("usage: %prog [options] path|directory|glob ...")
+cmd.add_option('', '--detectors',
+               help='Comma separated detectors to run, from: {}. (default: %default)'.format(', '.join(DETECTORS)),
+               default='double_compression,metadata,noise_variance,copy_move')
+cmd.add_option('-o', '--output',
+               help='JSON-lines result file, - for stdout. (default: %default)', default='-')
+cmd.add_option('', '--overlays',
+               help='Directory for marked-up copy-move and CFA, error level and noise heatmap images. (default: none)', default=None)
+cmd.add_option('', '--cache',
+               help='SIFT feature cache directory, empty to disable. (default: %default)', default='feature_cache')
+cmd.add_option('', '--workers', type='int',
+               help='Worker processes, 0 to run in this process. (default: %default)', default=0)
+cmd.add_option('', '--timeout', type='float',
+               help='Seconds allowed per image, 0 for no limit. (default: %default)', default=0)
+cmd.add_option('', '--unordered', action='store_true',
+               help='Write results as images finish instead of in input order.', default=False)
+cmd.add_option('', '--exact-dct', dest='exact_dct', action='store_true',
+               help='Read DCT coefficients from baseline JPEG files for double compression; slow.',
+               default=False)
+cmd.add_option('', '--elaquality', type='int',
+               help='JPEG quality of the error level re-encoding. (default: %default)', default=90)
+cmd.add_option('', '--eps',
+               help='Copy-move DBSCAN eps. (default: %default)', default=60)
+cmd.add_option('', '--min-samples', dest='min_samples',
+               help='Copy-move DBSCAN min_samples. (default: %default)', default=2)
+cmd.add_option('', '--verify', action='store_true',
+               help='Keep only copy-move matches explained by a RANSAC transform and report the regions.',
+               default=False)
+cmd.add_option('', '--imauto',
+               help='Automatically search identical regions. (default: %default)', default=1)
+cmd.add_option('', '--imblev',
+               help='Blur level for degrading image details. (default: %default)', default=8)
+cmd.add_option('', '--impalred',
+               help='Image palette reduction factor. (default: %default)', default=15)
+cmd.add_option(
+    '', '--rgsim', help='Region similarity threshold. (default: %default)', default=5)
+cmd.add_option(
+    '', '--rgsize', help='Region size threshold. (default: %default)', default=1.5)
+cmd.add_option(
+    '', '--blsim', help='Block similarity threshold. (default: %default)', default=200)
+cmd.add_option('', '--blcoldev',
+               help='Block color deviation threshold. (default: %default)', default=0.2)
+cmd.add_option(
+    '', '--blint', help='Block intersection threshold. (default: %default)', default=0.2)
+
+
+def expandInputs(args):
+    """
+    Function to turn command line arguments into image paths
+    :param args: Files, directories (searched recursively) or glob patterns
+    :return: A sorted list of unique image paths
+    """
+    paths = set()
+    for arg in args:
+        if os.path.isdir(arg):
+            for root, dirs, files in os.walk(arg):
+                paths.update(os.path.join(root, name) for name in files
+                             if name.lower().endswith(IMAGE_EXTENSIONS))
+        elif os.path.isfile(arg):
+            paths.add(arg)
+        else:
+            paths.update(path for path in glob.glob(arg, recursive=True)
+                         if os.path.isfile(path))
+    return sorted(paths)
+
+
+def overlayName(path, suffix):
+    # Flattens the image path so overlays from different directories with
+    # the same file name do not overwrite each other.
+    stem = os.path.splitext(os.path.normpath(path))[0].lstrip(os.sep)
+    return stem.replace(os.sep, '_').replace(':', '') + '_' + suffix + '.png'
+
+
+def analyzeImage(path, detectors, opt):
+    """
+    Function to run the selected detectors on one image without opening
+    any window
+    :param path: A string representing the path of the image file
+    :param detectors: Names of the detectors to run, from DETECTORS
+    :param opt: Parsed options of this module's command line
+    :return: A JSON-serialisable dict with the path, one entry per detector
+        and the elapsed seconds
+    """
+    start = time.time()
+    # one decode shared by the detectors; the views each derives from it are
+    # released before the next detector runs
+    context = AnalysisContext(path)
+    result = {'path': path}
+
+    if 'double_compression' in detectors:
+        result['double_compression'] = double_jpeg_compression.detect(context, exact=opt.exact_dct)
+        context.release()
+
+    if 'metadata' in detectors:
+        exif = context.exif
+        result['metadata'] = {ExifTags.TAGS[key]: str(val) for key, val in exif.items()
+                              if key in ExifTags.TAGS}
+
+    if 'noise_variance' in detectors:
+        sigma, result['noise_variance'] = noise_variance.detect_map(context)
+        # the map itself can be large, so the record holds its summary and
+        # the heatmap goes to the overlays
+        finite = sigma[np.isfinite(sigma)]
+        result['noise_sigma'] = {'blocks': list(sigma.shape)}
+        if finite.size:
+            result['noise_sigma'].update(min=round(float(finite.min()), 3),
+                                         mean=round(float(finite.mean()), 3),
+                                         max=round(float(finite.max()), 3))
+        if opt.overlays:
+            Image.fromarray(noise_variance.heatmap(sigma, size=context.header.size)).save(
+                os.path.join(opt.overlays, overlayName(path, 'noise_variance')))
+        context.release()
+
+    if 'cfa' in detectors:
+        regions, marked = copy_move_cfa.analyze(context, opt)
+        result['cfa'] = regions
+        if opt.overlays and regions:
+            marked.save(os.path.join(opt.overlays, overlayName(path, 'cfa')))
+        context.release()
+
+    if 'copy_move' in detectors:
+        detect = Detect(context)
+        detect.siftDetector(cache=FeatureCache(opt.cache) if opt.cache else None)
+        forgery = detect.locateForgery(int(opt.eps), int(opt.min_samples), verify=opt.verify)
+        result['copy_move'] = forgery is not None
+        if opt.verify:
+            result['copy_move_regions'] = [{'source': list(region['source']),
+                                            'target': list(region['target']),
+                                            'inliers': region['inliers']}
+                                           for region in detect.regions]
+        if opt.overlays and forgery is not None:
+            cv2.imwrite(os.path.join(opt.overlays, overlayName(path, 'copy_move')), forgery)
+        # the keypoints, descriptors and overlay are not needed past here
+        del detect, forgery
+        context.release()
+
+    if 'ela' in detectors:
+        error_level = error_level_analysis.ela(context, quality=opt.elaquality)
+        result['ela'] = {'mean': round(float(error_level.mean()), 3),
+                         'max': int(error_level.max())}
+        if opt.overlays:
+            Image.fromarray(error_level).save(os.path.join(opt.overlays, overlayName(path, 'ela')))
+        context.release()
+
+    result['seconds'] = round(time.time() - start, 3)
+    return result
+
+
+def failedImage(path, error):
+    return {'path': path, 'error': '{}: {}'.format(type(error).__name__, error)}
+
+
+def runImage(path, detectors, opt):
+    # One JSON-lines record; a failing image is reported, not raised.
+    try:
+        # detectors print progress, which must not end up in the results
+        with contextlib.redirect_stdout(sys.stderr):
+            return analyzeImage(path, detectors, opt)
+    except Exception as e:
+        return failedImage(path, e)
+
+
+def runImages(paths, detectors, opt):
+    # Yields one record per path, from a process pool when --workers is set.
+    if opt.workers > 0:
+        for path, result in schedule(runImage, paths, (detectors, opt), opt.workers,
+                                     opt.timeout or None, not opt.unordered,
+                                     failure=failedImage):
+            yield result
+    else:
+        for path in paths:
+            yield runTask(runImage, path, (detectors, opt), opt.timeout or None)
+
+
+def main(argv=None):
+    opt, args = cmd.parse_args(argv)
+    if not args:
+        cmd.print_help()
+        return 2
+    detectors = [name.strip() for name in opt.detectors.split(',') if name.strip()]
+    unknown = [name for name in detectors if name not in DETECTORS]
+    if unknown:
+        cmd.error('unknown detectors: {}'.format(', '.join(unknown)))
+    if opt.overlays:
+        os.makedirs(opt.overlays, exist_ok=True)
+
+    paths = expandInputs(args)
+    out = sys.stdout if opt.output == '-' else open(opt.output, 'w')
+    try:
+        for result in runImages(paths, detectors, opt):
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
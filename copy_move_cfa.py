@@ -2,16 +2,14 @@
 
 from importlib.resources import path
 import sys
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from scipy.spatial import cKDTree
 from PIL import Image, ImageFilter, ImageDraw
-import operator as op
 from optparse import OptionParser
 # import cv2
 
-
-def Dist(p1, p2):
-    x1, y1 = p1
-    x2, y2 = p2
-    return (((x1-x2)*(x1-x2)) + ((y1-y2)*(y1-y2)))**0.5
+from analysis_context import AnalysisContext
 
 
 def intersectarea(p1, p2, size):
@@ -25,129 +23,202 @@ def intersectarea(p1, p2, size):
     return iarea
 
 
-def Hausdorff_distance(clust1, clust2, forward, dir):
+def meandist(points, tree, limit=float('inf'), chunk=4096):
+    # Mean distance from points to their nearest neighbour in tree. The
+    # distances are non-negative, so once a partial sum exceeds the limit
+    # the mean is known to exceed it as well and the rest is skipped.
+    total, bound = 0.0, limit*len(points)
+    for i in range(0, len(points), chunk):
+        total += tree.query(points[i:i+chunk])[0].sum()
+        if total > bound:
+            break
+    return total/len(points)
+
+
+def Hausdorff_distance(clust1, clust2, forward, dir, limit=float('inf'), trees=None):
     if forward == None:
-        return max(Hausdorff_distance(clust1, clust2, True, dir), Hausdorff_distance(clust1, clust2, False, dir))
+        dist = Hausdorff_distance(clust1, clust2, True, dir, limit, trees)
+        if dist > limit:
+            return dist
+        return max(dist, Hausdorff_distance(clust1, clust2, False, dir, limit, trees))
     else:
         clstart, clend = (clust1, clust2) if forward else (clust2, clust1)
         dx, dy = dir if forward else (-dir[0], -dir[1])
-        return sum([min([Dist((p1[0]+dx, p1[1]+dy), p2) for p2 in clend]) for p1 in clstart])/len(clstart)
+        if trees is None:
+            tree = cKDTree(clend)
+        else:
+            tree = trees[1] if forward else trees[0]
+        return meandist(np.asarray(clstart) + (dx, dy), tree, limit)
 
 
-def hassimilarcluster(ind, clusters, opt):
-    item = op.itemgetter
+def hassimilarcluster(ind, clusters, opt, origins=None, trees=None):
+    if origins is None:
+        origins = np.array([np.min(cl, axis=0) for cl in clusters])
+    if trees is None:
+        trees = [cKDTree(cl) for cl in clusters]
     found = False
-    tx = min(clusters[ind], key=item(0))[0]
-    ty = min(clusters[ind], key=item(1))[1]
+    tx, ty = origins[ind]
     for i, cl in enumerate(clusters):
         if i != ind:
-            cx = min(cl, key=item(0))[0]
-            cy = min(cl, key=item(1))[1]
+            cx, cy = origins[i]
             dx, dy = cx - tx, cy - ty
-            specdist = Hausdorff_distance(clusters[ind], cl, None, (dx, dy))
+            specdist = Hausdorff_distance(clusters[ind], cl, None, (dx, dy),
+                                          int(opt.rgsim), (trees[ind], trees[i]))
             if specdist <= int(opt.rgsim):
                 found = True
                 break
     return found
 
 
-def blockpoints(pix, coords, size):
-    xs, ys = coords
-    for x in range(xs, xs+size):
-        for y in range(ys, ys+size):
-            yield pix[x, y]
-
-
 def colortopalette(color, palette):
     for a, b in palette:
         if color >= a and color < b:
             return b
 
 
-def imagetopalette(image, palcolors):
-    assert image.mode == 'L', "Only grayscale images supported !"
+def palettelut(palcolors):
+    # 256-entry lookup table equivalent to colortopalette. Colours at or
+    # above the last palette entry (e.g. pure white) have no interval and
+    # are mapped to that last entry.
     pal = [(palcolors[i], palcolors[i+1]) for i in range(len(palcolors)-1)]
-    image.putdata([colortopalette(c, pal) for c in list(image.getdata())])
+    lut = [colortopalette(c, pal) for c in range(256)]
+    return np.array([palcolors[-1] if c is None else c for c in lut], dtype=np.uint8)
 
 
-def getparts(image, block_len, opt):
-    img = image.convert('L') if image.mode != 'L' else image
-    w, h = img.size
-    parts = []
+def smoothimage(pix, level):
+    # SMOOTH_MORE applied `level` times to a uint8 array with PIL itself, so
+    # the rounding after every pass and the untouched 2 pixel frame match the
+    # filter the block matching thresholds were tuned with.
+    image = Image.fromarray(pix)
+    for n in range(level):
+        image = image.filter(ImageFilter.SMOOTH_MORE)
+    return np.asarray(image)
+
+
+def palettearray(pix, imblev, impalred):
     # Bluring image for abandoning image details and noise.
-    for n in range(int(opt.imblev)):
-        img = img.filter(ImageFilter.SMOOTH_MORE)
+    pix = smoothimage(pix, int(imblev))
     # Converting image to custom palette
-    imagetopalette(img, [x for x in range(256) if x % int(opt.impalred) == 0])
-    pix = img.load()
-
-    for x in range(w-block_len):
-        for y in range(h-block_len):
-            data = list(blockpoints(pix, (x, y), block_len)) + [(x, y)]
-            parts.append(data)
-    parts = sorted(parts)
-    return parts
-
-
-def similarparts(imagparts, opt):
-    dupl = []
-    l = len(imagparts[0])-1
-
-    for i in range(len(imagparts)-1):
-        difs = sum(abs(x-y)
-                   for x, y in zip(imagparts[i][:l], imagparts[i+1][:l]))
-        mean = float(sum(imagparts[i][:l])) / l
-        dev = float(sum(abs(mean-val) for val in imagparts[i][:l])) / l
-        if mean == 0:
-            mean = .000000000001
-        if dev/mean >= float(opt.blcoldev):
-            if difs <= int(opt.blsim):
-                if imagparts[i] not in dupl:
-                    dupl.append(imagparts[i])
-                if imagparts[i+1] not in dupl:
-                    dupl.append(imagparts[i+1])
-
-    return dupl
+    lut = palettelut([x for x in range(256) if x % int(impalred) == 0])
+    return np.take(lut, pix)
+
+
+def getparts(image, block_len, opt):
+    if isinstance(image, AnalysisContext):
+        pix = image.palette(opt.imblev, opt.impalred)
+    else:
+        img = image.convert('L') if image.mode != 'L' else image
+        pix = palettearray(np.asarray(img, dtype=np.uint8), opt.imblev, opt.impalred)
+
+    return blockparts(pix, block_len)
+
+
+def blockparts(pix, block_len):
+    # Returns every overlapping block of the (h, w) array as a
+    # (blocks, coords) pair: a uint8 matrix holding one flattened block per
+    # row and the int32 (x, y) origin of each row, in (x, y) order.
+    h, w = pix.shape
+    nx, ny = max(w-block_len, 0), max(h-block_len, 0)
+    sy, sx = pix.strides
+    # Strided view indexed [x, y, dx, dy], so each block flattens in the
+    # same column-major order the per-pixel loop used to produce.
+    view = as_strided(pix, shape=(nx, ny, block_len, block_len),
+                      strides=(sx, sy, sx, sy), writeable=False)
+    blocks = view.reshape(-1, block_len*block_len)
+
+    xs, ys = np.meshgrid(np.arange(nx, dtype=np.int32),
+                         np.arange(ny, dtype=np.int32), indexing='ij')
+    coords = np.column_stack((xs.ravel(), ys.ravel()))
+    return blocks, coords
+
+
+def sortparts(blocks):
+    # Lexicographic row order. Each row is compared as one opaque byte
+    # string (unsigned bytes order like the uint8 values), and the stable
+    # sort keeps the (x, y) tie-break of the generation order. Only the
+    # permutation is returned, so no sorted copy of the blocks is made.
+    keys = blocks.view(np.dtype((np.void, blocks.shape[1]))).ravel()
+    return np.argsort(keys, kind='stable')
+
+
+def similarparts(imagparts, opt, chunk=1 << 16):
+    blocks, coords = imagparts
+    blocks = np.ascontiguousarray(blocks)
+    order = sortparts(blocks)
+    n, l = blocks.shape
+    dupl = np.zeros(n, dtype=bool)
+
+    # Compare every block with its successor in sorted order, gathering a
+    # chunk of rows at a time to bound the sorted copy and int32 temporaries.
+    for start in range(0, n-1, chunk):
+        end = min(start+chunk, n-1)
+        rows = blocks[order[start:end+1]].astype(np.int32)
+        cur = rows[:-1]
+        difs = np.abs(cur - rows[1:]).sum(axis=1)
+        mean = cur.sum(axis=1) / float(l)
+        dev = np.abs(cur - mean[:, None]).sum(axis=1) / l
+        mean[mean == 0] = .000000000001
+        match = (dev/mean >= float(opt.blcoldev)) & (difs <= int(opt.blsim))
+        dupl[start:end] |= match
+        dupl[start+1:end+1] |= match
+
+    order = order[dupl]
+    return blocks[order], coords[order]
+
+
+def findroot(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
 
 
 def clusterparts(parts, block_len, opt):
-    parts = sorted(parts, key=op.itemgetter(-1))
-    clusters = [[parts[0][-1]]]
-
-    # assign all parts to clusters
-    for i in range(1, len(parts)):
-        x, y = parts[i][-1]
-
-        # detect box already in cluster
-        fc = []
-        for k, cl in enumerate(clusters):
-            for xc, yc in cl:
-                ar = intersectarea((xc, yc), (x, y), block_len)
-                intrat = float(ar)/(block_len*block_len)
-                if intrat > float(opt.blint):
-                    if not fc:
-                        clusters[k].append((x, y))
-                    fc.append(k)
-                    break
-
-        # if this is new cluster
-        if not fc:
-            clusters.append([(x, y)])
-        else:
-            # re-clustering boxes if in several clusters at once
-            while len(fc) > 1:
-                clusters[fc[0]] += clusters[fc[-1]]
-                del clusters[fc[-1]]
-                del fc[-1]
+    blocks, coords = parts
+    if not len(coords):
+        return []
+    coords = coords[np.lexsort((coords[:, 1], coords[:, 0]))]
+    points = coords.tolist()
+    parent = list(range(len(points)))
+
+    # Blocks can only intersect when both offsets are below block_len, so
+    # bucketing origins on a block_len grid limits each test to the 3x3
+    # neighbouring cells. Overlapping blocks are joined with union-find.
+    grid = {}
+    for i, (x, y) in enumerate(points):
+        gx, gy = x // block_len, y // block_len
+        for cx in (gx-1, gx, gx+1):
+            for cy in (gy-1, gy, gy+1):
+                for j in grid.get((cx, cy), ()):
+                    ar = intersectarea(points[j], (x, y), block_len)
+                    intrat = float(ar)/(block_len*block_len)
+                    if intrat > float(opt.blint):
+                        ri, rj = findroot(parent, i), findroot(parent, j)
+                        if ri != rj:
+                            parent[max(ri, rj)] = min(ri, rj)
+        grid.setdefault((gx, gy), []).append(i)
+
+    # Roots are the smallest member index, so ordering clusters by root
+    # keeps the order in which the clusters were first seen.
+    roots = np.array([findroot(parent, i) for i in range(len(points))])
+    order = np.argsort(roots, kind='stable')
+    splits = np.flatnonzero(np.diff(roots[order])) + 1
+    clusters = np.split(coords[order], splits)
+
+    # bounding boxes are computed once and shared by both filters
+    lows = np.array([clust.min(axis=0) for clust in clusters])
+    highs = np.array([clust.max(axis=0) for clust in clusters])
 
-    item = op.itemgetter
     # filter out small clusters
-    clusters = [clust for clust in clusters if Dist((min(clust, key=item(0))[0], min(clust, key=item(
-        1))[1]), (max(clust, key=item(0))[0], max(clust, key=item(1))[1]))/(block_len*1.4) >= float(opt.rgsize)]
+    diag = np.hypot(*(highs - lows).T)
+    keep = np.flatnonzero(diag/(block_len*1.4) >= float(opt.rgsize))
+    clusters = [clusters[k] for k in keep]
+    lows = lows[keep]
 
     # filter out clusters, which doesn`t have identical twin cluster
+    trees = [cKDTree(clust) for clust in clusters]
     clusters = [clust for x, clust in enumerate(
-        clusters) if hassimilarcluster(x, clusters, opt)]
+        clusters) if hassimilarcluster(x, clusters, opt, lows, trees)]
 
     return clusters
 
@@ -159,7 +230,7 @@ def marksimilar(image, clust, size, opt):
         draw = ImageDraw.Draw(image)
         mask = Image.new('RGB', (size, size), 'cyan')
         for cl in clust:
-            for x, y in cl:
+            for x, y in np.asarray(cl).tolist():
                 im = image.crop((x, y, x+size, y+size))
                 im = Image.blend(im, mask, 0.5)
                 blocks.append((x, y, im))
@@ -168,26 +239,33 @@ def marksimilar(image, clust, size, opt):
             image.paste(im, (x, y, x+size, y+size))
         if int(opt.imauto):
             for cl in clust:
-                cx1 = min([cx for cx, _ in cl])
-                cy1 = min([cy for _, cy in cl])
-                cx2 = max([cx for cx, _ in cl]) + block_len
-                cy2 = max([cy for _, cy in cl]) + block_len
+                cx1, cy1 = np.asarray(cl).min(axis=0).tolist()
+                cx2, cy2 = (np.asarray(cl).max(axis=0) + block_len).tolist()
                 draw.rectangle([cx1, cy1, cx2, cy2], outline="magenta")
     return image
 
 
-def detect(path, opt, args):
+def analyze(path, opt):
+    # Headless search: returns the number of identical regions and the
+    # image with the matching blocks marked.
     block_len = 15
-    im = Image.open(path)
-    lparts = getparts(im, block_len, opt)
+    context = AnalysisContext.of(path)
+    im = context.image()
+    lparts = getparts(context, block_len, opt)
     dparts = similarparts(lparts, opt)
     cparts = clusterparts(dparts, block_len, opt) if int(
-        opt.imauto) else [[elem[-1] for elem in dparts]]
+        opt.imauto) else [dparts[1]]
     im = marksimilar(im, cparts, block_len, opt)
-    out = path.split('.')[0] + '_analyzed.jpg'
+    identical_regions = len(cparts) if int(opt.imauto) else 0
+    return identical_regions, im
+
+
+def detect(path, opt, args):
+    context = AnalysisContext.of(path)
+    identical_regions, im = analyze(context, opt)
+    out = context.path.split('.')[0] + '_analyzed.jpg'
     im.show(out)
     # im.save(out)
-    identical_regions = len(cparts) if int(opt.imauto) else 0
     # print('\tCopy-move output is saved in file -', out)
     return(identical_regions)
 
@@ -1,25 +1,44 @@
 import numpy as np
 # import pandas as pd
-import cv2
 # import argparse
 # import csv
 # import sys
 
 from scipy import fftpack as fftp
-from matplotlib import pyplot as plt
 
+from analysis_context import AnalysisContext
+import jpeg_coefficients
 
-def detect(image):
-    firstq = 30
-    secondq = 40
-    thres = 0.5
 
+def dctmatrix(n=8):
+    # Orthonormal DCT-II basis, the transform cv2.dct applies to a block.
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    basis = np.cos(np.pi * (2*i + 1) * k / (2*n)) * np.sqrt(2.0/n)
+    basis[0] /= np.sqrt(2)
+    return basis.astype(np.float32)
+
+
+def blockdct(blocks, chunk=1 << 16):
+    # DCT of every (n, n) block of a (count, n, n) array, computed as
+    # D @ B @ D.T in float32 into a preallocated array, a chunk of blocks at
+    # a time to bound the intermediate product.
+    basis = dctmatrix(blocks.shape[-1])
+    coeffs = np.empty(blocks.shape, dtype=np.float32)
+    for start in range(0, len(blocks), chunk):
+        np.matmul(np.matmul(basis, blocks[start:start+chunk], dtype=np.float32),
+                  basis.T, out=coeffs[start:start+chunk])
+    return coeffs
+
+
+def decodedcoefficients(image):
+    # Approximates the block DCTs by decoding the image and transforming the
+    # luma channel again.
     dct_rows = 0
     dct_cols = 0
 
-    image = cv2.imread(image)
-    # image = cv2.imread(image)
-    shape = image.shape
+    context = AnalysisContext.of(image)
+    shape = context.bgr.shape[:2]
 
     if shape[0] % 8 != 0:
         dct_rows = shape[0]+8-shape[0] % 8
@@ -31,49 +50,99 @@ def detect(image):
     else:
         dct_cols = shape[1]
 
-    dct_image = np.zeros((dct_rows, dct_cols, 3), np.uint8)
-    dct_image[0:shape[0], 0:shape[1]] = image
-
-    y = cv2.cvtColor(dct_image, cv2.COLOR_BGR2YCR_CB)[:, :, 0]
+    # padding with black gives zero luma
+    y = np.zeros((dct_rows, dct_cols), np.uint8)
+    y[0:shape[0], 0:shape[1]] = context.ycrcb[:, :, 0]
 
     w = y.shape[1]
     h = y.shape[0]
-    n = w*h/64
 
     Y = y.reshape(h//8, 8, -1, 8).swapaxes(1, 2).reshape(-1, 8, 8)
-
-    qDCT = []
-
-    for i in range(0, Y.shape[0]):
-        qDCT.append(cv2.dct(np.float32(Y[i])))
-
-    qDCT = np.asarray(qDCT, dtype=np.float32)
-    qDCT = np.rint(qDCT - np.mean(qDCT, axis=0)).astype(np.int32)
-    f, a1 = plt.subplots(8, 8)
-    a1 = a1.ravel()
-
-    k = 0
-    # flag = True
-    for idx, ax in enumerate(a1):
-        k += 1
-        data = qDCT[:, int(idx/8), int(idx % 8)]
-        val, key = np.histogram(data, bins=np.arange(data.min(), data.max()+1))
-        # val, key = np.histogram(data, bins=np.arange(data.min(), data.max()+1), normed=True)
-        z = np.absolute(fftp.fft(val))
-        z = np.reshape(z, (len(z), 1))
-        rotz = np.roll(z, int(len(z)/2))
-
-        slope = rotz[1:] - rotz[:-1]
-        indices = [i+1 for i in range(len(slope)-1)
-                   if slope[i] > 0 and slope[i+1] < 0]
-
-        peak_count = 0
-
-        for j in indices:
-            if rotz[j][0] > thres:
-                peak_count += 1
-
-        if(k==3):
-            if peak_count>=20: return True
-            else: return False
-            # flag = False         
+    return blockdct(Y)
+
+
+def blockcoefficients(image, exact=False):
+    # Luma DCT coefficients of every 8x8 block as a (count, 8, 8) float32
+    # array, by decoding and re-transforming. With exact, baseline JPEGs are
+    # instead read from the file and dequantized; that reader is pure Python
+    # and some 25 times slower, so it is only worth it when rounding matters.
+    if not exact:
+        return decodedcoefficients(image)
+    try:
+        coeffs, qtable = jpeg_coefficients.read_coefficients(AnalysisContext.of(image).path)
+    except ValueError:
+        return decodedcoefficients(image)
+    return (coeffs * qtable).reshape(-1, 8, 8).astype(np.float32)
+
+
+# AC coefficients in zig-zag order up to the fourth anti-diagonal.
+LOW_FREQUENCIES = ((0, 1), (1, 0), (2, 0), (1, 1), (0, 2),
+                   (0, 3), (1, 2), (2, 1), (3, 0),
+                   (4, 0), (3, 1), (2, 2), (1, 3), (0, 4))
+
+
+def centredcoefficients(qDCT, coefficients):
+    # The given (row, col) coefficients of every block as a (blocks, count)
+    # array, each centred on its mean and rounded.
+    rows, cols = zip(*coefficients)
+    data = qDCT[:, list(rows), list(cols)].astype(np.float64)
+    return np.rint(data - np.mean(data, axis=0)).astype(np.int32)
+
+
+def peakcounts(data, thres=0.5):
+    # Number of peaks above thres in the centred FFT magnitude of each
+    # column's histogram; periodic histograms from double quantization
+    # produce many of them.
+    low, high = data.min(axis=0), data.max(axis=0)
+    # Same bins as np.histogram over arange(min, max+1): the last bin also
+    # holds the maximum.
+    sizes = high - low
+    used = np.flatnonzero(sizes > 0)
+    offsets = np.cumsum(sizes[used]) - sizes[used]
+    idx = np.minimum(data[:, used] - low[used], sizes[used] - 1) + offsets
+    hist = np.bincount(idx.ravel(), minlength=int(sizes[used].sum()))
+
+    # Spectra of different lengths are padded with NaN, which never
+    # compares as a peak or as a peak's lower neighbour.
+    spectra = np.full((len(used), int(sizes.max()) if len(used) else 0), np.nan)
+    for n, (offset, size) in enumerate(zip(offsets, sizes[used])):
+        z = np.absolute(fftp.fft(hist[offset:offset+size]))
+        spectra[n, :size] = np.roll(z, int(size/2))
+
+    mid = spectra[:, 1:-1]
+    peaks = (mid > spectra[:, :-2]) & (mid > spectra[:, 2:]) & (mid > thres)
+    counts = np.zeros(data.shape[1], dtype=np.int64)
+    counts[used] = peaks.sum(axis=1)
+    return counts
+
+
+def score(image, coefficients=LOW_FREQUENCIES, thres=0.5, peaks=20,
+          confidence=1.0, batch=4, exact=False):
+    """
+    Scores a set of DCT coefficients for double quantization
+    :param image: A string representing the path of the image file
+    :param coefficients: (row, col) positions of the coefficients to score
+    :param thres: Minimum FFT magnitude of a histogram peak
+    :param peaks: Peak count that gives a coefficient full confidence
+    :param confidence: Confidence at which scoring stops early
+    :param batch: Number of coefficients scored per pass
+    :param exact: Read the quantized coefficients of baseline JPEGs from the
+        file instead of re-transforming the decoded image; much slower
+    :return: A float32 array with one confidence in [0, 1] per coefficient;
+        coefficients skipped after an early stop are NaN
+    """
+    qDCT = blockcoefficients(image, exact)
+    scores = np.full(len(coefficients), np.nan, dtype=np.float32)
+    for start in range(0, len(coefficients), batch):
+        chunk = coefficients[start:start+batch]
+        counts = peakcounts(centredcoefficients(qDCT, chunk), thres)
+        scores[start:start+len(chunk)] = np.minimum(counts / float(peaks), 1.0)
+        if np.nanmax(scores) >= confidence:
+            break
+    return scores
+
+
+def detect(image, coefficients=((0, 2),), confidence=1.0, exact=False):
+    # By default only the third coefficient in row-major order is scored.
+    scores = score(image, coefficients, confidence=confidence, exact=exact)
+    return bool(np.nanmax(scores) >= confidence)
@@ -0,0 +1,30 @@
+from matplotlib import pyplot as plt
+import numpy as np
+
+import double_jpeg_compression
+
+
+def plot(image, thres=0.5, exact=False):
+    """
+    Diagnostic view of the double compression detector, kept out of
+    double_jpeg_compression so the detector never imports pyplot
+    :param image: A string representing the path of the image file
+    :param thres: Peak threshold passed to the detector's peak count
+    :param exact: Read the coefficients from the JPEG file, see
+        double_jpeg_compression.score
+    :return: A matplotlib figure with the histogram of each of the 64 DCT
+        coefficients, titled with its peak count
+    """
+    qDCT = double_jpeg_compression.blockcoefficients(image, exact)
+    coefficients = [(row, col) for row in range(8) for col in range(8)]
+    data = double_jpeg_compression.centredcoefficients(qDCT, coefficients)
+    counts = double_jpeg_compression.peakcounts(data, thres)
+
+    f, a1 = plt.subplots(8, 8, figsize=(16, 16))
+    for idx, ax in enumerate(a1.ravel()):
+        column = data[:, idx]
+        ax.hist(column, bins=np.arange(column.min(), column.max()+1))
+        ax.set_title(str(counts[idx]), fontsize=8)
+        ax.tick_params(labelsize=6)
+    f.tight_layout()
+    return f
@@ -1,29 +1,16 @@
-import cv2
+import sys
 
+from steganography import embedfile
 
-# Encryption function
-def encrypt():
-
-    # img1 and img2 are the
-    # two input images
-    img1 = cv2.imread('1.jpg')
-    img2 = cv2.imread('2.jpg')
-
-    for i in range(img2.shape[0]):
-        for j in range(img2.shape[1]):
-            for l in range(3):
 
-                # v1 and v2 are 8-bit pixel values
-                # of img1 and img2 respectively
-                v1 = format(img1[i][j][l], '08b')
-                v2 = format(img2[i][j][l], '08b')
-
-                # Taking 4 MSBs of each image
-                v3 = v1[:4] + v2[:4]
-
-                img1[i][j][l] = int(v3, 2)
+# Encryption function
+def encrypt(cover='1.jpg', secret='2.jpg', output='3.png', bits=4):
 
-    cv2.imwrite('3.png', img1)
+    # The most significant bits of the secret image replace
+    # the least significant bits of the cover image
+    embedfile(cover, secret, output, int(bits))
 
 
-encrypt()
+if __name__ == '__main__':
+    # python encode_image.py [cover secret output [bits]]
+    encrypt(*sys.argv[1:])
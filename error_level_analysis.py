@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+
+from PIL import Image, ImageChops
+import numpy as np
+
+from analysis_context import AnalysisContext
+
+
+def recompress(image, quality):
+    # JPEG round trip through memory, so concurrent analyses share no file.
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality)
+    buffer.seek(0)
+    return Image.open(buffer)
+
+
+def scaletable(scale, bands):
+    # Image.point lookup table multiplying every band by scale, clipped to 255.
+    return [min(255, int(v * scale)) for v in range(256)] * bands
+
+
+def ela(input, quality=90, scale=10):
+    """
+    Function to compute the error level of an image: the difference to its
+    own JPEG re-encoding, amplified so that regions compressed differently
+    from the rest stand out
+    :param input: A string representing the path of the image file, or an
+        AnalysisContext
+    :param quality: JPEG quality of the re-encoding
+    :param scale: Factor the absolute difference is multiplied by
+    :return: A uint8 RGB array of the image's shape
+    """
+    original = AnalysisContext.of(input).image()
+    diff = ImageChops.difference(original, recompress(original, quality))
+    return np.asarray(diff.point(scaletable(scale, len(diff.getbands()))))
+
+
+# Re-encoding qualities of the sweep. 100 is left out: it is the closest
+# re-encoding almost everywhere and would win every block.
+QUALITIES = tuple(range(50, 100, 5))
+
+
+def blockmeans(diff, blockSize, stripBlocks=16):
+    # Mean of an (h, w, bands) difference over blockSize x blockSize blocks;
+    # the last row and column of blocks may be partial. The bands are summed
+    # stripBlocks block rows at a time, so no full-frame sum is held.
+    h, w = diff.shape[:2]
+    cols = np.arange(0, w, blockSize)
+    sums = np.empty((-(-h // blockSize), len(cols)), dtype=np.uint64)
+    step = blockSize * stripBlocks
+    for top in range(0, h, step):
+        strip = diff[top:top + step].sum(axis=2, dtype=np.uint32)
+        strip = np.add.reduceat(strip, np.arange(0, len(strip), blockSize), axis=0)
+        sums[top // blockSize:top // blockSize + len(strip)] = np.add.reduceat(strip, cols, axis=1)
+    rows = np.arange(0, h, blockSize)
+    counts = np.outer(np.diff(np.append(rows, h)), np.diff(np.append(cols, w)))
+    return (sums / (counts * diff.shape[2])).astype(np.float32)
+
+
+def sweep(input, qualities=QUALITIES, blockSize=8, workers=None):
+    """
+    Function to re-encode an image at several JPEG qualities and keep only
+    the mean error of every block. A region pasted from an image saved at
+    another quality reaches its lowest error at that quality
+    :param input: A string representing the path of the image file, an
+        AnalysisContext or a uint8 RGB array
+    :param qualities: JPEG qualities to re-encode at
+    :param blockSize: Side of the square blocks the error is averaged over
+    :param workers: Number of encoder threads, one per quality up to the
+        number of cores by default
+    :return: A tuple (errors, best) where errors is a float32 array of shape
+        (qualities, block rows, block cols) and best holds, per block, the
+        quality with the lowest error
+    """
+    if isinstance(input, np.ndarray):
+        pixels = input
+    else:
+        pixels = AnalysisContext.of(input).rgb
+
+    def blockerror(quality):
+        # Image.save keeps its settings on the image, so every thread needs
+        # its own; the full difference image only lives inside this call
+        original = Image.fromarray(pixels)
+        diff = ImageChops.difference(original, recompress(original, quality))
+        return blockmeans(np.asarray(diff), blockSize)
+
+    # Pillow releases the GIL while encoding and decoding
+    workers = workers or min(len(qualities), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        errors = np.stack(list(pool.map(blockerror, qualities)))
+    best = np.asarray(qualities)[errors.argmin(axis=0)]
+    return errors, best
@@ -0,0 +1,91 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+import cv2
+
+
+class FeatureCache(object):
+    """
+    On-disk cache of SIFT keypoints and descriptors. Entries are .npz files
+    named by the SHA-256 of the image bytes and the detector parameters,
+    and the least recently used ones are evicted once the directory grows
+    past maxBytes.
+    """
+
+    def __init__(self, directory='feature_cache', maxBytes=1 << 30):
+        self.directory = directory
+        self.maxBytes = maxBytes
+
+    def key(self, path, params):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        digest.update(repr(sorted(params.items())).encode('utf8'))
+        return digest.hexdigest()
+
+    def entry(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def load(self, key):
+        # Returns (keypoints, descriptors), or None when the key is missing.
+        entry = self.entry(key)
+        try:
+            with np.load(entry) as data:
+                floats, ints = data['floats'], data['ints']
+                descriptors = data['descriptors']
+        except (OSError, KeyError, ValueError):
+            return None
+        # refresh the entry's age for LRU eviction, unless another process
+        # evicted it meanwhile
+        try:
+            os.utime(entry)
+        except FileNotFoundError:
+            pass
+        key_points = [cv2.KeyPoint(float(x), float(y), float(size), float(angle),
+                                   float(response), int(octave), int(class_id))
+                      for (x, y, size, angle, response), (octave, class_id)
+                      in zip(floats.tolist(), ints.tolist())]
+        return key_points, (descriptors if descriptors.size else None)
+
+    def store(self, key, key_points, descriptors):
+        os.makedirs(self.directory, exist_ok=True)
+        floats = np.array([(kp.pt[0], kp.pt[1], kp.size, kp.angle, kp.response)
+                           for kp in key_points], dtype=np.float32).reshape(-1, 5)
+        ints = np.array([(kp.octave, kp.class_id) for kp in key_points],
+                        dtype=np.int32).reshape(-1, 2)
+        if descriptors is None:
+            descriptors = np.zeros((0, 128), dtype=np.float32)
+        # write under a temporary name of its own so that readers never see
+        # a partial file and concurrent writers of one key never share one
+        fd, temp = tempfile.mkstemp(dir=self.directory, prefix=key + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, floats=floats, ints=ints, descriptors=descriptors)
+            os.replace(temp, self.entry(key))
+        except BaseException:
+            os.remove(temp)
+            raise
+        self.evict()
+
+    def evict(self):
+        # other processes may remove entries while this one scans them
+        stats = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                entry = os.path.join(self.directory, name)
+                try:
+                    stats.append((os.stat(entry), entry))
+                except FileNotFoundError:
+                    pass
+        total = sum(stat.st_size for stat, _ in stats)
+        for stat, entry in sorted(stats, key=lambda item: item[0].st_mtime):
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(entry)
+            except OSError:
+                pass
+            total -= stat.st_size
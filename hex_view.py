@@ -0,0 +1,162 @@
+import mmap
+from tkinter import *
+from tkinter import font
+
+import numpy as np
+
+
+HEXDIGITS = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+
+
+class HexView(object):
+    """
+    Hex dump of a file, rendered a page at a time. The file is memory
+    mapped, so seeking to any row is a slice and only the rows on screen
+    are ever formatted. Lines look like:
+
+    00000010  00 01 02 03 04 05 06 07  08 09 0a 0b 0c 0d 0e 0f  |................|
+    """
+
+    def __init__(self, path, width=16):
+        self.path = path
+        self.width = width
+        with open(path, 'rb') as f:
+            try:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty files cannot be mapped
+                self.data = b''
+        self.size = len(self.data)
+        self.rows = -(-self.size // width)
+        self.digits = max(8, len('{:x}'.format(self.size)))
+
+        # column of the first hex digit of every byte; the two halves of a
+        # row are separated by an extra space
+        half = width // 2
+        self.hexcols = self.digits + 2 + 3*np.arange(width) + (np.arange(width) >= half)
+        self.bar = self.digits + 2 + 3*width + 2
+        self.linewidth = self.bar + width + 2
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def rowAt(self, offset):
+        # Row holding the byte at offset, clamped to the file.
+        return min(max(int(offset), 0), max(self.size - 1, 0)) // self.width
+
+    def page(self, row, count):
+        """
+        Function to format rows of the dump
+        :param row: Index of the first row
+        :param count: Number of rows
+        :return: A list of at most count lines
+        """
+        row = min(max(int(row), 0), self.rows)
+        count = min(max(int(count), 0), self.rows - row)
+        if not count:
+            return []
+        start = row * self.width
+        chunk = np.frombuffer(self.data[start:start + count*self.width], dtype=np.uint8)
+        filled = len(chunk)
+        values = np.zeros(count * self.width, dtype=np.uint8)
+        values[:filled] = chunk
+        values = values.reshape(count, self.width)
+
+        lines = np.full((count, self.linewidth), ord(' '), dtype=np.uint8)
+        offsets = (row + np.arange(count, dtype=np.int64)) * self.width
+        shifts = 4 * np.arange(self.digits - 1, -1, -1)
+        lines[:, :self.digits] = HEXDIGITS[(offsets[:, None] >> shifts) & 15]
+        lines[:, self.hexcols] = HEXDIGITS[values >> 4]
+        lines[:, self.hexcols + 1] = HEXDIGITS[values & 15]
+        lines[:, self.bar] = ord('|')
+        printable = (values >= 32) & (values < 127)
+        lines[:, self.bar+1:self.bar+1+self.width] = np.where(printable, values, ord('.'))
+        lines[:, -1] = ord('|')
+
+        text = lines.tobytes().decode('ascii')
+        result = [text[i*self.linewidth:(i+1)*self.linewidth] for i in range(count)]
+
+        # a short last row: blank the missing bytes and close the ASCII column
+        tail = filled - (count - 1) * self.width
+        if tail < self.width:
+            last = list(result[-1])
+            for col in self.hexcols[tail:]:
+                last[col:col+2] = '  '
+            result[-1] = ''.join(last[:self.bar+1+tail]) + '|'
+        return result
+
+
+class HexViewer(Frame):
+    """
+    Tk widget scrolling a HexView. The Text only ever holds the visible
+    lines; the scrollbar, mouse wheel and offset box move the window.
+    """
+
+    def __init__(self, master, view, lines=32, **kw):
+        Frame.__init__(self, master, **kw)
+        self.view = view
+        self.lines = lines
+        self.top = 0
+
+        bar = Frame(self)
+        bar.pack(side=TOP, fill=X)
+        Label(bar, text='Size: {:x} bytes   Go to offset (hex):'.format(view.size)).pack(side=LEFT)
+        self.offset = Entry(bar, width=view.digits + 2)
+        self.offset.pack(side=LEFT)
+        self.offset.bind('<Return>', self.gotoOffset)
+
+        self.scroll = Scrollbar(self, command=self.yview)
+        self.scroll.pack(side=RIGHT, fill=Y)
+        self.text = Text(self, height=lines, width=view.linewidth, wrap=NONE,
+                         font='TkFixedFont')
+        self.text.pack(side=LEFT, fill=BOTH, expand=True)
+        self.text.bind('<Configure>', self.resize)
+        self.text.bind('<MouseWheel>', self.wheel)
+        self.text.bind('<Button-4>', lambda event: self.goto(self.top - 3) or 'break')
+        self.text.bind('<Button-5>', lambda event: self.goto(self.top + 3) or 'break')
+        self.render()
+
+    def yview(self, *args):
+        # Scrollbar protocol: ('moveto', fraction) or ('scroll', n, units|pages)
+        if args[0] == 'moveto':
+            self.goto(int(float(args[1]) * self.view.rows))
+        elif args[0] == 'scroll':
+            step = self.lines if args[2] == 'pages' else 1
+            self.goto(self.top + int(args[1]) * step)
+
+    def wheel(self, event):
+        self.goto(self.top - 3 * int(event.delta / abs(event.delta or 1)))
+        return 'break'
+
+    def resize(self, event):
+        linespace = font.nametofont('TkFixedFont').metrics('linespace')
+        lines = max(1, event.height // linespace)
+        if lines != self.lines:
+            self.lines = lines
+            self.goto(self.top)
+
+    def gotoOffset(self, event=None):
+        try:
+            offset = int(self.offset.get().strip(), 16)
+        except ValueError:
+            return
+        self.goto(self.view.rowAt(offset))
+
+    def goto(self, row):
+        self.top = min(max(int(row), 0), max(self.view.rows - self.lines, 0))
+        self.render()
+
+    def render(self):
+        self.text.config(state=NORMAL)
+        self.text.delete('1.0', END)
+        self.text.insert('1.0', '\n'.join(self.view.page(self.top, self.lines)))
+        self.text.config(state=DISABLED)
+        rows = max(self.view.rows, 1)
+        self.scroll.set(self.top / rows, min(1.0, (self.top + self.lines) / rows))
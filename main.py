@@ -1,6 +1,8 @@
 import sys
 import cv2
 from ForgeryDetection import Detect
+from feature_cache import FeatureCache
+from analysis_context import AnalysisContext
 import re
 from datetime import datetime
 import os.path as path
@@ -11,6 +13,7 @@ from PIL import Image, ExifTags
 import double_jpeg_compression
 import copy_move_cfa
 import noise_variance
+import error_level_analysis
 
 from optparse import OptionParser
 
@@ -32,6 +35,15 @@ cmd.add_option('', '--blcoldev',
                help='Block color deviation threshold. (default: %default)', default=0.2)
 cmd.add_option(
     '', '--blint', help='Block intersection threshold. (default: %default)', default=0.2)
+cmd.add_option('', '--verify', action='store_true',
+               help='Keep only copy-move matches explained by a RANSAC transform and list the regions.',
+               default=False)
+
+# error level analysis parameters
+cmd.add_option('', '--ela',
+               help='Save the error level image to this file. (default: none)', default=None)
+cmd.add_option('', '--elaquality',
+               help='JPEG quality of the error level re-encoding. (default: %default)', default=90)
 opt, args = cmd.parse_args()
 if not args:
     cmd.print_help()
@@ -50,13 +62,18 @@ if not path.exists(input):
     sys.exit(
         "Image not found: {}. Please place the image in the images subdirectory.".format(file_name))
 
+# every detector shares one decode of the image; the views a detector
+# derives from it are released once it is done
+context = AnalysisContext(input)
+
 
 
 
 # double jpeg compression detection Start
 PrintBoundary()
 print('\nRunning double jpeg compression detection...')
-double_compressed = double_jpeg_compression.detect(input)
+double_compressed = double_jpeg_compression.detect(context)
+context.release()
 
 if(double_compressed):
     print('\nDouble compression detected')
@@ -70,8 +87,7 @@ PrintBoundary()
 # Metadata Analysis detection Start
 PrintBoundary()
 print('\nRunning Metadata Analysis detection')
-img = Image.open(input)
-img_exif = img.getexif()
+img_exif = context.exif
 
 if img_exif is None:
     print('Sorry, image has no exif data.')
@@ -86,7 +102,7 @@ PrintBoundary()
 # # CFA artifact detection Start
 # PrintBoundary()
 # print('\nRunning CFA artifact detection...\n')
-# identical_regions_cfa = copy_move_cfa.detect(input, opt, args)
+# identical_regions_cfa = copy_move_cfa.detect(context, opt, args)
 # print('\n' + str(identical_regions_cfa), 'CFA artifacts detected')
 # PrintBoundary()
 # # CFA artifact detection End
@@ -96,7 +112,8 @@ PrintBoundary()
 # noise variance inconsistency detection Start
 PrintBoundary()
 print('\nRunning noise variance inconsistency detection...')
-noise_forgery = noise_variance.detect(input)
+noise_forgery = noise_variance.detect(context)
+context.release()
 
 if(noise_forgery):
     print('\nNoise variance inconsistency detected')
@@ -107,6 +124,20 @@ PrintBoundary()
 
 
 
+# Error Level Analysis Start
+PrintBoundary()
+print('\nRunning Error Level Analysis...')
+error_level = error_level_analysis.ela(context, quality=int(opt.elaquality))
+context.release()
+print('\nMean error level: {:.2f}, max: {}'.format(error_level.mean(), error_level.max()))
+if opt.ela:
+    Image.fromarray(error_level).save(opt.ela)
+    print('Error level image saved as....', opt.ela)
+PrintBoundary()
+# Error Level Analysis End
+
+
+
 
 # Copy-Move detection Start
 
@@ -154,11 +185,13 @@ print('Detecting Copy-Move Forgery with parameter value as\neps:{}\nmin_samples:
     eps, min_samples))
 PrintBoundary()
 
-detect = Detect(input)
+detect = Detect(context)
 
-key_points, descriptors = detect.siftDetector()
+key_points, descriptors = detect.siftDetector(cache=FeatureCache())
 
-forgery = detect.locateForgery(eps, min_samples)
+forgery = detect.locateForgery(eps, min_samples, verify=opt.verify)
+for region in detect.regions:
+    print('Region {} copied to {} ({} inliers)'.format(region['source'], region['target'], region['inliers']))
 if forgery is None:
     sys.exit(0)
 cv2.imshow('Original image', detect.image)
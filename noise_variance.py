@@ -3,41 +3,147 @@ import math
 import numpy as np
 
 from PIL import Image
-from scipy import signal
-from sklearn.cluster import KMeans
 
-def estimate_noise(I):
+from analysis_context import AnalysisContext
+
+def blocksigma(blocks):
+    # Noise sigma of every block of a (rows, h, cols, w) array. Every block
+    # is convolved with M on its own with full output, that is with a zero
+    # border of its own, and normalised by its size as estimate_noise was.
+    rows, h, cols, w = blocks.shape
+    if h < 3 or w < 3:
+        return np.full((rows, cols), np.nan)
+    padded = np.zeros((rows, h + 4, cols, w + 4), dtype=np.int32)
+    padded[:, 2:-2, :, 2:-2] = blocks
+
+    # M = [[1, -2, 1], [-2, 4, -2], [1, -2, 1]] is [1, -2, 1] applied along
+    # the rows and then along the columns
+    vertical = padded[:, :-2] - 2*padded[:, 1:-1] + padded[:, 2:]
+    response = vertical[..., :-2] - 2*vertical[..., 1:-1] + vertical[..., 2:]
+
+    sums = np.absolute(response).sum(axis=(1, 3))
+    return sums * math.sqrt(0.5 * math.pi) / (6 * (h-2) * (w-2))
+
+
+def blocknoise(I, blockSize=32):
+    # Noise sigma of every blockSize x blockSize block of a 2-D array, as a
+    # (block rows, block cols) array. Blocks on the right and bottom edges
+    # keep their real size; those less than 3 pixels across are NaN.
     H, W = I.shape
+    fullRows, fullCols = H // blockSize, W // blockSize
+    sigma = np.empty((-(-H // blockSize), -(-W // blockSize)))
+    for top, h, rows in ((0, blockSize, fullRows), (fullRows * blockSize, H % blockSize, 1)):
+        for left, w, cols in ((0, blockSize, fullCols), (fullCols * blockSize, W % blockSize, 1)):
+            if not (h and w and rows and cols):
+                continue
+            part = I[top:top + rows*h, left:left + cols*w]
+            sigma[top // blockSize:top // blockSize + rows, left // blockSize:left // blockSize + cols] = \
+                blocksigma(part.reshape(rows, h, cols, w))
+    return sigma
 
-    M = [[1, -2, 1], [-2, 4, -2], [1, -2, 1]]
 
-    sigma = np.sum(np.sum(np.absolute(signal.convolve2d(I, M))))
-    sigma = sigma * math.sqrt(0.5 * math.pi) / (6 * (W-2) * (H-2))
+def noise_map(input, blockSize=32, stripBlocks=8):
+    """
+    Function to estimate the noise sigma of every block of an image, one
+    strip of block rows at a time. Memory stays bounded by the strip only
+    for an already binarised array such as an np.memmap: a path or an
+    AnalysisContext is decoded and binarised as a whole frame first
+    :param input: A string representing the path of the image file, an
+        AnalysisContext, or a 2-D array such as an np.memmap that is
+        already binarised
+    :param blockSize: Side of the square blocks in pixels
+    :param stripBlocks: Number of block rows converted and convolved at once
+    :return: A float32 array with one sigma per block; blocks on the edges
+        less than 3 pixels across are NaN
+    """
+    if isinstance(input, AnalysisContext):
+        input = input.binary
+    if isinstance(input, np.ndarray):
+        H, W = input.shape
+        read = lambda top, bottom: np.asarray(input[top:bottom], dtype=np.int32)
+    else:
+        im = Image.open(input)
+        im = im.convert('1')
+        W, H = im.size
+        read = lambda top, bottom: np.asarray(im.crop((0, top, W, bottom)), dtype=np.int32)
 
+    sigma = np.empty((-(-H // blockSize), -(-W // blockSize)), dtype=np.float32)
+    step = blockSize * stripBlocks
+    for top in range(0, H, step):
+        strip = blocknoise(read(top, min(top + step, H)), blockSize)
+        sigma[top // blockSize:top // blockSize + strip.shape[0]] = strip
     return sigma
 
-def detect(input, blockSize=32):
-    im = Image.open(input)
-    im = im.convert('1')
 
-    blocks = []
+# Colours of the heatmap from the lowest to the highest sigma.
+HEATMAP_COLORS = np.array([(0, 0, 128), (0, 0, 255), (0, 255, 255),
+                           (255, 255, 0), (255, 0, 0), (128, 0, 0)], dtype=np.float64)
+
 
-    imgwidth, imgheight = im.size
+def heatmap(sigma, blockSize=32, size=None):
+    """
+    Function to colour a noise sigma map, blue for the lowest sigma through
+    to red for the highest, so regions with foreign noise stand out
+    :param sigma: A noise map as returned by noise_map
+    :param blockSize: Pixels each block is drawn with
+    :param size: Optional (width, height) the heatmap is cropped to,
+        normally the image's size
+    :return: A uint8 RGB array; NaN blocks are black
+    """
+    finite = np.isfinite(sigma)
+    low, high = (sigma[finite].min(), sigma[finite].max()) if finite.any() else (0, 0)
+    level = np.zeros(sigma.shape)
+    if high > low:
+        level[finite] = (sigma[finite] - low) / (high - low)
+    stops = np.linspace(0, 1, len(HEATMAP_COLORS))
+    colors = np.stack([np.interp(level, stops, HEATMAP_COLORS[:, band]) for band in range(3)], axis=-1)
+    colors[~finite] = 0
+    colors = np.repeat(np.repeat(colors.astype(np.uint8), blockSize, axis=0), blockSize, axis=1)
+    if size is not None:
+        colors = colors[:size[1], :size[0]]
+    return colors
 
-    # break up image into NxN blocks, N = blockSize
-    for i in range(0,imgheight,blockSize):
-        for j in range(0,imgwidth,blockSize):
-            box = (j, i, j+blockSize, i+blockSize)
-            b = im.crop(box)
-            a = np.asarray(b).astype(int)
-            blocks.append(a)
 
-    variances = []
-    for block in blocks:
-        variances.append([estimate_noise(block)])
+def twomeans(values):
+    # Exact two-cluster split of 1-D data. Every optimal split of sorted
+    # values is a prefix/suffix pair, so prefix sums score all n-1 splits at
+    # once; the best one maximises the between-cluster sum of squares.
+    x = np.sort(np.asarray(values, dtype=np.float64).ravel())
+    n = len(x)
+    if n < 2:
+        return x.mean(), x.mean()
+    size = np.arange(1, n)
+    left = np.cumsum(x)[:-1]
+    right = x.sum() - left
+    i = np.argmax(left**2 / size + right**2 / (n - size))
+    return left[i] / size[i], right[i] / (n - size[i])
 
-    kmeans = KMeans(n_clusters=2, random_state=0).fit(variances)
-    center1, center2 = kmeans.cluster_centers_
+
+def inconsistent(sigma, engine='twomeans'):
+    # Two-cluster split of the finite block sigmas; the noise is
+    # inconsistent when the cluster centres are far apart. engine='kmeans'
+    # uses sklearn's KMeans as before.
+    variances = sigma[np.isfinite(sigma)].reshape(-1, 1)
+
+    if engine == 'kmeans':
+        from sklearn.cluster import KMeans
+        kmeans = KMeans(n_clusters=2, random_state=0).fit(variances)
+        center1, center2 = kmeans.cluster_centers_
+    elif engine == 'twomeans':
+        center1, center2 = twomeans(variances)
+    else:
+        raise ValueError('Unknown clustering engine: {}'.format(engine))
 
     if abs(center1 - center2) > .4: return True
     else: return False
+
+
+def detect_map(input, blockSize=32, stripBlocks=8, engine='twomeans'):
+    # Returns (noise_map(...), verdict) so callers can localise the
+    # inconsistency as well as report it.
+    sigma = noise_map(input, blockSize, stripBlocks)
+    return sigma, inconsistent(sigma, engine)
+
+
+def detect(input, blockSize=32, engine='twomeans'):
+    return detect_map(input, blockSize, engine=engine)[1]
@@ -0,0 +1,225 @@
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
+import multiprocessing
+import os
+import signal
+import time
+
+
+# Seconds past a task's time limit before the parent kills its pool, which
+# leaves the in-worker alarm the first chance to stop it gently.
+GRACE = 1.0
+# Longest the parent waits before looking for newly started tasks again.
+POLL = 1.0
+
+started = None
+
+
+def initWorker(queue=None, threads=1):
+    # Runs once in every worker process, so the heavy libraries and the
+    # detector modules are imported once per process instead of per task.
+    global started
+    started = queue
+    import cv2
+    import scipy.signal
+    import scipy.spatial
+    import sklearn.cluster
+    import double_jpeg_compression
+    import noise_variance
+    import copy_move_cfa
+    import ForgeryDetection
+    # the pool already runs one task per core
+    cv2.setNumThreads(threads)
+
+
+def expire(signum, frame):
+    raise TimeoutError('task exceeded its time limit')
+
+
+def runTask(task, item, args, timeout):
+    # Runs in the worker. The alarm interrupts the task the next time it
+    # returns to Python, so the worker itself survives and moves on.
+    timed = timeout and hasattr(signal, 'setitimer')
+    if timed:
+        signal.signal(signal.SIGALRM, expire)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return task(item, *args)
+    finally:
+        if timed:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def startTask(index, task, item, args, timeout):
+    # Tells the parent which task this worker picked up before running it,
+    # so that only started tasks are timed and suspected of a crash.
+    if started is not None:
+        started.put(index)
+    return runTask(task, item, args, timeout)
+
+
+def kill(pool):
+    # Native code never sees the alarm, so a stuck pool is killed outright.
+    for process in list((pool._processes or {}).values()):
+        process.kill()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def failed(item, error):
+    return {'item': item, 'error': '{}: {}'.format(type(error).__name__, error)}
+
+
+def schedule(task, items, args=(), workers=None, timeout=None, ordered=True,
+             inflight=None, failure=failed):
+    """
+    Function to run task(item, *args) for every item on a process pool
+    :param task: A picklable module-level function
+    :param items: Iterable of items, consumed lazily
+    :param args: Extra arguments passed to every call
+    :param workers: Number of worker processes, all cores by default
+    :param timeout: Seconds a single task may run before it is stopped; a
+        task still running shortly after is killed with its pool
+    :param ordered: Yield results in input order instead of as they finish
+    :param inflight: Most tasks submitted at once, so that long inputs are
+        fed to the pool in chunks; four per worker by default
+    :param failure: Called with (item, exception) to build the result of a
+        task that raised, timed out or whose worker died
+    :return: A generator of (item, result) pairs
+    """
+    workers = workers or os.cpu_count() or 1
+    inflight = inflight or 4 * workers
+    pending = iter(enumerate(items))
+    requeued = deque()
+    tasks = {}
+    queues = {}
+    startedAt = {}
+    finished = {}
+    nextIndex = 0
+
+    def newPool(size):
+        queue = multiprocessing.SimpleQueue()
+        pool = ProcessPoolExecutor(max_workers=size, initializer=initWorker, initargs=(queue,))
+        queues[pool] = queue
+        return pool
+
+    def submit(pool, index, item):
+        future = pool.submit(startTask, index, task, item, args, timeout)
+        tasks[future] = (index, item, pool)
+
+    def drain():
+        now = time.monotonic()
+        for queue in queues.values():
+            while not queue.empty():
+                startedAt.setdefault(queue.get(), now)
+
+    def retire(pool, stuck=False):
+        del queues[pool]
+        if stuck:
+            kill(pool)
+        else:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    pool = newPool(workers)
+    try:
+        while True:
+            while len(tasks) < inflight:
+                if requeued:
+                    index, item = requeued.popleft()
+                else:
+                    entry = next(pending, None)
+                    if entry is None:
+                        break
+                    index, item = entry
+                submit(pool, index, item)
+            if not tasks and not finished:
+                break
+
+            if tasks:
+                drain()
+                limit = None
+                if timeout:
+                    now = time.monotonic()
+                    starts = [startedAt[index] for index, _, _ in tasks.values() if index in startedAt]
+                    if starts:
+                        limit = max(min(starts) + timeout + GRACE - now, 0)
+                    if len(starts) < len(tasks):
+                        limit = min(limit, POLL) if limit is not None else POLL
+                done, _ = wait(tasks, timeout=limit, return_when=FIRST_COMPLETED)
+                drain()
+
+                lost = {}
+                for future in done:
+                    index, item, owner = tasks.pop(future)
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool as e:
+                        lost.setdefault(owner, []).append((index, item, e))
+                        continue
+                    except Exception as e:
+                        result = failure(item, e)
+                    finished[index] = (item, result)
+                    startedAt.pop(index, None)
+                    if owner is not pool:
+                        retire(owner)
+
+                # Tasks past their deadline fail; the pools they run in are
+                # killed along with whatever else those pools were running.
+                stuck = set()
+                if timeout:
+                    now = time.monotonic()
+                    for future, (index, item, owner) in list(tasks.items()):
+                        if index in startedAt and now - startedAt[index] > timeout + GRACE:
+                            del tasks[future]
+                            finished[index] = (item, failure(item, TimeoutError('task exceeded its time limit')))
+                            startedAt.pop(index)
+                            stuck.add(owner)
+
+                # A dead worker takes its whole pool down. Tasks that had not
+                # started are simply submitted again; any started one may be
+                # the one that crashed, so unless it ran alone, each is run
+                # again in a pool of its own, all at once. Only a task that
+                # kills a pool of its own is reported as failed.
+                suspects = []
+                for owner in stuck | set(lost):
+                    victims = [(index, item) for index, item, _ in lost.get(owner, [])]
+                    for future, (index, item, other) in list(tasks.items()):
+                        if other is owner:
+                            del tasks[future]
+                            victims.append((index, item))
+                    alone = owner is not pool
+                    retire(owner, stuck=True)
+                    if not alone:
+                        pool = newPool(workers)
+
+                    ran = [victim for victim in victims if startedAt.pop(victim[0], None) is not None]
+                    if owner not in lost:
+                        requeued.extend(victims)
+                        continue
+                    if alone or not ran:
+                        # a pool that dies before any task starts would not
+                        # run them either
+                        blamed = victims
+                    elif len(ran) == 1:
+                        blamed = ran
+                    else:
+                        blamed = []
+                        suspects.extend(ran)
+                    for index, item in blamed:
+                        finished[index] = (item, failure(item, lost[owner][0][2]))
+                    settled = set(index for index, _ in ran + blamed)
+                    requeued.extend(victim for victim in victims if victim[0] not in settled)
+                for index, item in suspects:
+                    submit(newPool(1), index, item)
+
+            if ordered:
+                while nextIndex in finished:
+                    yield finished.pop(nextIndex)
+                    nextIndex += 1
+            else:
+                for index in list(finished):
+                    yield finished.pop(index)
+    finally:
+        # pools still holding tasks were abandoned mid-run
+        for owner in list(queues):
+            retire(owner, stuck=bool(tasks))
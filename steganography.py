@@ -0,0 +1,126 @@
+import sys
+from optparse import OptionParser
+
+from PIL import Image
+import numpy as np
+import cv2
+
+from analysis_context import AnalysisContext
+
+
+cmd = OptionParser("usage: %prog [options] image_file")
+cmd.add_option('-p', '--planes',
+               help='Comma separated bit planes to extract, 0 is the least significant. (default: %default)',
+               default='0,1,2,3')
+cmd.add_option('-o', '--output',
+               help='File to save the extracted image to, shown when omitted. (default: none)', default=None)
+cmd.add_option('', '--zero', action='store_true',
+               help='Fill the remaining bits with zeros instead of noise.', default=False)
+cmd.add_option('', '--seed', type='int',
+               help='Seed of the fill noise. (default: random)', default=None)
+
+
+def extract(input, planes=(0, 1, 2, 3), noise=True, seed=None):
+    """
+    Function to reveal an image hidden in the low bits of another. The
+    selected bit planes are moved, highest first, to the top of every byte
+    :param input: A string representing the path of the image file, an
+        AnalysisContext or a uint8 array
+    :param planes: Indices of the bit planes to extract, 0 is the least
+        significant bit
+    :param noise: Fill the remaining low bits with random bits, as the GUI
+        always did, instead of zeros
+    :param seed: Seed of the fill noise
+    :return: A uint8 array of the input's shape
+    """
+    if isinstance(input, np.ndarray):
+        pixels = input
+    else:
+        pixels = AnalysisContext.of(input).rgb
+    planes = sorted(set(int(plane) for plane in planes), reverse=True)
+    if not planes or planes[-1] < 0 or planes[0] > 7:
+        raise ValueError('Bit planes must be between 0 and 7')
+
+    hidden = np.zeros_like(pixels)
+    bit = np.empty_like(pixels)
+    for rank, plane in enumerate(planes):
+        np.right_shift(pixels, plane, out=bit)
+        bit &= 1
+        bit <<= 7 - rank
+        hidden |= bit
+
+    fill = 8 - len(planes)
+    if noise and fill:
+        rng = np.random.default_rng(seed)
+        hidden |= rng.integers(0, 1 << fill, size=pixels.shape, dtype=np.uint8)
+    return hidden
+
+
+def embed(cover, secret, bits=4, strip=256):
+    """
+    Function to hide one image in the low bits of another: the top bits of
+    every secret byte replace the low bits of the cover byte
+    :param cover: A uint8 array; it is modified in place
+    :param secret: A uint8 array with the cover's number of channels
+    :param bits: How many low bits of the cover carry the secret, 1 to 8
+    :param strip: Rows processed at a time, bounding the temporary memory
+    :return: The cover array. Where the sizes differ only the overlapping
+        top-left region is embedded, the rest of the cover is kept
+    """
+    if not 1 <= bits <= 8:
+        raise ValueError('bits must be between 1 and 8')
+    if cover.shape[2:] != secret.shape[2:]:
+        raise ValueError('Cover and secret must have the same number of channels')
+    rows = min(cover.shape[0], secret.shape[0])
+    cols = min(cover.shape[1], secret.shape[1])
+    keep = np.uint8((0xFF << bits) & 0xFF)
+    low = np.empty((min(strip, rows),) + (cols,) + cover.shape[2:], dtype=np.uint8)
+
+    for top in range(0, rows, strip):
+        bottom = min(top + strip, rows)
+        part = cover[top:bottom, :cols]
+        carry = low[:bottom - top]
+        np.right_shift(secret[top:bottom, :cols], 8 - bits, out=carry)
+        part &= keep
+        part |= carry
+    return cover
+
+
+def embedfile(coverPath, secretPath, outputPath, bits=4, strip=256):
+    """
+    Function to hide the image at secretPath in the image at coverPath
+    :param coverPath: A string representing the path of the cover image
+    :param secretPath: A string representing the path of the hidden image
+    :param outputPath: Where to save the result, in a lossless format
+    :param bits: How many low bits of the cover carry the secret
+    :param strip: Rows processed at a time
+    :return: None
+    """
+    cover = cv2.imread(coverPath)
+    secret = cv2.imread(secretPath)
+    for path, image in ((coverPath, cover), (secretPath, secret)):
+        if image is None:
+            raise ValueError('Cannot decode image: {}'.format(path))
+    if not cv2.imwrite(outputPath, embed(cover, secret, bits, strip)):
+        raise ValueError('Cannot write image: {}'.format(outputPath))
+
+
+def main(argv=None):
+    opt, args = cmd.parse_args(argv)
+    if len(args) != 1:
+        cmd.print_help()
+        return 2
+    planes = [int(plane) for plane in opt.planes.split(',') if plane.strip()]
+    try:
+        hidden = Image.fromarray(extract(args[0], planes, not opt.zero, opt.seed))
+    except ValueError as e:
+        cmd.error(str(e))
+    if opt.output:
+        hidden.save(opt.output)
+    else:
+        hidden.show()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,15 @@
+import numpy as np
+
+from error_level_analysis import sweep
+
+
+def test_threaded_sweep_matches_single_thread():
+    rng = np.random.default_rng(0)
+    ramp = np.linspace(0, 150, 1201)[None, :, None]
+    pixels = (rng.random((901, 1201, 3)) * 60 + ramp).astype(np.uint8)
+
+    errors, best = sweep(pixels, workers=1)
+    for _ in range(3):
+        threaded, threadedBest = sweep(pixels)
+        assert np.array_equal(threaded, errors)
+        assert np.array_equal(threadedBest, best)
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from double_jpeg_compression import dctmatrix
+from jpeg_coefficients import read_coefficients
+
+
+def pixels(mode, size=(77, 53)):
+    # Gradients under noise, sized so that the last blocks and MCUs are partial.
+    w, h = size
+    rng = np.random.default_rng(0)
+    ramp = np.add.outer(np.linspace(0, 120, h), np.linspace(0, 80, w))
+    if mode == 'L':
+        return (ramp + rng.random((h, w)) * 60).astype(np.uint8)
+    return (ramp[..., None] + rng.random((h, w, 3)) * 60).astype(np.uint8)
+
+
+def decodedluma(path):
+    # Y plane exactly as libjpeg decodes it, before any colour conversion.
+    image = Image.open(path)
+    image.draft('YCbCr', image.size)
+    return np.asarray(image)[..., 0] if image.mode == 'YCbCr' else np.asarray(image)
+
+
+@pytest.mark.parametrize('mode, options', [
+    ('RGB', {'subsampling': 2}),
+    ('RGB', {'subsampling': 1}),
+    ('RGB', {'subsampling': 0}),
+    ('L', {}),
+    ('RGB', {'subsampling': 2, 'restart_marker_blocks': 3}),
+    ('RGB', {'subsampling': 1, 'restart_marker_rows': 1}),
+    ('L', {'restart_marker_blocks': 5}),
+])
+def test_coefficients_invert_to_decoded_luma(tmp_path, mode, options):
+    path = str(tmp_path / 'fixture.jpg')
+    Image.fromarray(pixels(mode)).save(path, 'JPEG', quality=85, **options)
+    if 'restart_marker_blocks' in options or 'restart_marker_rows' in options:
+        with open(path, 'rb') as f:
+            assert b'\xff\xd0' in f.read()
+
+    coefficients, qtable = read_coefficients(path)
+    basis = dctmatrix().astype(np.float64)
+    blocks = basis.T @ (coefficients * qtable) @ basis + 128
+    rows, cols = coefficients.shape[:2]
+    luma = np.clip(np.rint(blocks), 0, 255).swapaxes(1, 2).reshape(rows * 8, cols * 8)
+
+    expected = decodedluma(path)
+    assert luma.shape[0] >= expected.shape[0] and luma.shape[1] >= expected.shape[1]
+    luma = luma[:expected.shape[0], :expected.shape[1]]
+    assert np.abs(luma - expected).max() <= 1
+
+
+@pytest.mark.parametrize('offset, value', [
+    # component id of the SOS scan
+    ('sos', 0x09),
+    # Huffman table selectors of the SOS scan
+    ('sos_tables', 0x33),
+    # quantization table selector of the luma component
+    ('sof_tq', 0x03),
+])
+def test_damaged_headers_raise_value_error(tmp_path, offset, value):
+    path = str(tmp_path / 'fixture.jpg')
+    Image.fromarray(pixels('RGB')).save(path, 'JPEG', quality=85)
+    with open(path, 'rb') as f:
+        data = bytearray(f.read())
+    sos = data.index(b'\xff\xda')
+    sof = data.index(b'\xff\xc0')
+    position = {'sos': sos + 5, 'sos_tables': sos + 6, 'sof_tq': sof + 12}[offset]
+    data[position] = value
+    with open(path, 'wb') as f:
+        f.write(data)
+    with pytest.raises(ValueError):
+        read_coefficients(path)
+
+
+def test_run_past_last_coefficient_raises_value_error(tmp_path):
+    # A DHT whose only AC symbol is 0xF1, a run of 15 zeros then a 1-bit
+    # value, so the fourth symbol of the block would pass coefficient 63.
+    path = str(tmp_path / 'fixture.jpg')
+    Image.fromarray(pixels('L', (8, 8))).save(path, 'JPEG', quality=85)
+    with open(path, 'rb') as f:
+        data = f.read()
+    sos = data.index(b'\xff\xda')
+    dht = b'\xff\xc4\x00\x26' + b'\x00' + b'\x01' + b'\x00' * 15 + b'\x00' \
+        + b'\x10' + b'\x01' + b'\x00' * 15 + b'\xf1'
+    scan = b'\xff\xda\x00\x08\x01\x01\x00\x00\x3f\x00'
+    # DC symbol 0 (code 0), then AC symbol 0xF1 (code 0) with value bit 1,
+    # repeated: 0 | 01 01 01 01 01 ...
+    entropy = b'\x2a\xaa\xaa\xaa'
+    with open(path, 'wb') as f:
+        f.write(data[:sos] + dht + scan + entropy + b'\xff\xd9')
+    with pytest.raises(ValueError):
+        read_coefficients(path)